@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from urllib.request import urlopen
+
+import pandas as pd
+
+from dataset import dataset_version, load_wells, td_month
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+SERVICE_URL = os.environ.get("AGGREGATE_SERVICE_URL", f"http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+CLIENT_TIMEOUT = 10
+CACHE_SIZE = 256
+
+FILTER_COLUMNS = {"operator": "Operator", "contractor": "Contractor", "shaker": "flowline_Shakers", "hole_size": "Hole_Size"}
+RANGE_FILTERS = {"int_length": "IntLength", "amw": "AMW", "lgs": "Average_LGS%", "years": "TD_Year"}
+CORR_COLS = ["DSRE", "Total_SCE", "Total_Dil", "Discard Ratio", "Dilution_Ratio", "ROP", "AMW", "Haul_OFF"]
+COST_DEFAULTS = {"d_screen_cost": 50.0, "nd_screen_cost": 55.0, "d_equip_rate": 2500.0, "nd_equip_rate": 1250.0,
+                 "screen_life": 7.0, "eng_rate": 150.0, "op_days": 10.0}
+
+
+# ---------- Computations ----------
+def apply_filters(df, params):
+    """Apply the dashboards' filter selections, passed as strings ("lo,hi" for ranges)."""
+    if params.get("search"):
+        term = params["search"].lower()
+        df = df[df.astype(str).apply(lambda col: col.str.lower().str.contains(term)).any(axis=1)]
+    for key, col in FILTER_COLUMNS.items():
+        if params.get(key) not in (None, "", "All") and col in df.columns:
+            value = float(params[key]) if key == "hole_size" else params[key]
+            df = df[df[col] == value]
+    if params.get("basins"):
+        df = df[df["DI Basin"].isin(params["basins"].split(","))]
+    for key, col in RANGE_FILTERS.items():
+        if params.get(key) and col in df.columns:
+            lo, hi = (float(v) for v in params[key].split(","))
+            df = df[(df[col] >= lo) & (df[col] <= hi)]
+    if params.get("td_year"):
+        df = df[df["TD_Year"] == int(params["td_year"])]
+    if params.get("td_month"):
+        df = df[td_month(df["TD_Date"]) == params["td_month"]]
+    return df
+
+
+def shaker_type(df):
+    return df["flowline_Shakers"].apply(
+        lambda x: "Derrick" if isinstance(x, str) and "derrick" in x.lower() else "Non-Derrick"
+    )
+
+
+def _metrics(df, params, default):
+    requested = params["metrics"].split(",") if params.get("metrics") else default
+    return [m for m in requested if m in df.columns]
+
+
+def _mean(df, col):
+    return df[col].mean() if col in df.columns else float("nan")
+
+
+def kpis(df, params):
+    return {
+        "wells": len(df),
+        "avg_total_dil": _mean(df, "Total_Dil"),
+        "avg_sce": _mean(df, "Total_SCE"),
+        "avg_dsre": _mean(df, "DSRE"),
+        "max_haul_off": df["Haul_OFF"].max() if "Haul_OFF" in df.columns else float("nan"),
+        "max_depth": df["Depth"].max() if "Depth" in df.columns else float("nan"),
+        "avg_lgs": _mean(df, "Average_LGS%"),
+        "avg_dilution_ratio": _mean(df, "Dilution_Ratio"),
+        "avg_discard_ratio": _mean(df, "Discard Ratio"),
+    }
+
+
+def well_cube(df, params):
+    metrics = _metrics(df, params, CORR_COLS)
+    return df.groupby("Well_Name")[metrics].mean().reset_index()
+
+
+def correlations(df, params):
+    # pairwise=1 uses every row with both values (main2.py); default drops incomplete rows first (mapp.py)
+    values = df[_metrics(df, params, CORR_COLS)]
+    return values.corr() if params.get("pairwise") == "1" else values.dropna().corr()
+
+
+def shaker_comparison(df, params):
+    metrics = _metrics(df, params, ["DSRE", "ROP", "Total_Dil"])
+    means = df[metrics].groupby(shaker_type(df)).mean().reindex(["Derrick", "Non-Derrick"])
+    melted = means.T.rename_axis("Metric").reset_index()
+    return pd.melt(melted, id_vars="Metric", value_vars=["Derrick", "Non-Derrick"],
+                   var_name="Shaker_Type", value_name="Average")
+
+
+def costs(df, params):
+    p = {key: float(params.get(key, default)) for key, default in COST_DEFAULTS.items()}
+    types = shaker_type(df)
+
+    def calc_cost(group, screen_cost, equip_rate):
+        wells = group["Well_Name"].nunique()
+        scr = len(group) * (p["op_days"] / p["screen_life"]) * screen_cost
+        eq = wells * p["op_days"] * equip_rate
+        eng = wells * p["op_days"] * p["eng_rate"]
+        total = scr + eq + eng
+        depth = group["Depth"].sum() if "Depth" in group.columns else 1
+        return {"total": total, "cpf": total / depth if depth else 0, "screen": scr, "equipment": eq,
+                "engineering": eng, "depth": depth}
+
+    derrick = calc_cost(df[types == "Derrick"], p["d_screen_cost"], p["d_equip_rate"])
+    non_derrick = calc_cost(df[types == "Non-Derrick"], p["nd_screen_cost"], p["nd_equip_rate"])
+    return {"Derrick": derrick, "Non-Derrick": non_derrick,
+            "saving": non_derrick["total"] - derrick["total"], "cpf_diff": derrick["cpf"] - non_derrick["cpf"]}
+
+
+ENDPOINTS = {
+    "kpis": kpis,
+    "well_cube": well_cube,
+    "correlations": correlations,
+    "shaker_comparison": shaker_comparison,
+    "costs": costs,
+}
+
+
+def compute(endpoint, data, params):
+    return ENDPOINTS[endpoint](apply_filters(data, params), params)
+
+
+# ---------- Wire format ----------
+def _clean(obj):
+    if isinstance(obj, dict):
+        return {k: _clean(v) for k, v in obj.items()}
+    if isinstance(obj, float) and math.isnan(obj):
+        return None
+    if hasattr(obj, "item"):
+        return _clean(obj.item())
+    return obj
+
+
+def encode(result):
+    if isinstance(result, pd.DataFrame):
+        return {"frame": json.loads(result.to_json(orient="split"))}
+    return {"value": _clean(result)}
+
+
+def decode(payload):
+    if "frame" in payload:
+        frame = payload["frame"]
+        df = pd.DataFrame(frame["data"], index=frame["index"], columns=frame["columns"])
+        # JSON nulls come back as None in object columns; restore the float NaN the local path returns
+        for col in df.columns:
+            if df[col].map(lambda v: v is None or isinstance(v, (int, float))).all():
+                df[col] = df[col].astype("float64")
+        return df
+
+    def restore(obj):
+        if isinstance(obj, dict):
+            return {k: restore(v) for k, v in obj.items()}
+        return float("nan") if obj is None else obj
+    return restore(payload["value"])
+
+
+# ---------- Service ----------
+class AggregateService:
+    """Shared result cache with request coalescing: identical concurrent queries compute once."""
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._data = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _dataset(self, version):
+        with self._lock:
+            if version != self._version:
+                self._data = load_wells()
+                self._version = version
+            return self._data
+
+    def _run(self, endpoint, params, version):
+        return json.dumps(encode(compute(endpoint, self._dataset(version), params))).encode("utf-8")
+
+    async def get(self, endpoint, params):
+        version = dataset_version()
+        key = (version, endpoint, tuple(sorted(params.items())))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(None, self._run, endpoint, params, version)
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._finish(key, f))
+        return await asyncio.shield(future)
+
+    def _finish(self, key, future):
+        del self._inflight[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._cache[key] = future.result()
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1")
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            method, target, _ = request_line.split(" ", 2)
+            url = urlsplit(target)
+            endpoint = url.path.strip("/")
+            if method != "GET" or endpoint not in ENDPOINTS:
+                status, body = "404 Not Found", json.dumps({"error": f"unknown endpoint: {url.path}"}).encode()
+            else:
+                status, body = "200 OK", await self.get(endpoint, dict(parse_qsl(url.query)))
+        except (ValueError, KeyError) as e:
+            status, body = "400 Bad Request", json.dumps({"error": str(e)}).encode()
+        except Exception as e:
+            status, body = "500 Internal Server Error", json.dumps({"error": str(e)}).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    service = AggregateService()
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Aggregate service listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+# ---------- Client ----------
+class AggregateServiceError(RuntimeError):
+    pass
+
+
+def fetch_aggregate(endpoint, params=None, local_data=None):
+    """Fetch an aggregate from the service, computing it locally on local_data if the service is unreachable.
+
+    Errors reported by a running service are raised as AggregateServiceError, not computed around.
+    """
+    params = {k: ",".join(map(str, v)) if isinstance(v, (list, tuple)) else str(v)
+              for k, v in (params or {}).items() if v not in (None, "", "All", [], ())}
+    try:
+        with urlopen(f"{SERVICE_URL}/{endpoint}?{urlencode(params)}", timeout=CLIENT_TIMEOUT) as resp:
+            return decode(json.loads(resp.read()))
+    except HTTPError as e:
+        try:
+            message = json.loads(e.read()).get("error", e.reason)
+        except ValueError:
+            message = e.reason
+        raise AggregateServiceError(f"Aggregate service returned {e.code} for /{endpoint}: {message}") from e
+    except (URLError, OSError):
+        data = local_data if local_data is not None else load_wells()
+        return compute(endpoint, data, params)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve dashboard aggregates over HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
@@ -0,0 +1,166 @@
+import os
+import shutil
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = ds = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_PATH = os.path.join(BASE_DIR, "Updated_Merged_Data_with_API_and_Location.csv")
+STORE_PATH = os.path.join(BASE_DIR, "well_data_parquet")
+BUILD_CHUNK_ROWS = 100_000
+
+# Read as text in every chunk; all other CSV columns are stored as float64
+TEXT_COLUMNS = ["UWI_Number", "Operator", "Contractor", "Well_Name", "flowline_Shakers", "TD_Date",
+                "Basin", "DI Basin", "AAPG Geologic Province", "API Number"]
+
+# Unnamed index column the CSV was exported with; identifies a well row across projected loads
+ROW_ID = "Unnamed: 0"
+
+# Peer groups shared by the benchmark (main2.py) and anomaly (mapp.py) views
+PEER_KEYS = ["Peer_Basin", "Hole_Size", "Shaker_Vendor"]
+PEER_COLUMNS = ["DI Basin", "Hole_Size", "flowline_Shakers"]
+MIN_PEERS = 5
+
+# Hive layout: well_data_parquet/State Code=42/DI Basin=DELAWARE/TD_Year=2021/part-0-0.parquet
+PARTITION_FIELDS = [("State Code", "float64"), ("DI Basin", "string"), ("TD_Year", "int32")]
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([(name, getattr(pa, dtype)()) for name, dtype in PARTITION_FIELDS]), flavor="hive")
+
+
+def _text_dtypes(columns):
+    return {c: str for c in TEXT_COLUMNS if c in columns}
+
+
+def _store_schema(columns):
+    fields = [(c, pa.string() if c in TEXT_COLUMNS else pa.float64()) for c in columns]
+    return pa.schema(fields + [("TD_Year", pa.int32())])
+
+
+def parse_td_date(td_date):
+    # TD_Date mixes "13-08-2017" and "2019-10-01 00:00:00"
+    return pd.to_datetime(td_date, errors="coerce", format="mixed", dayfirst=True)
+
+
+def td_month(td_date):
+    return parse_td_date(td_date).dt.strftime("%B")
+
+
+def add_td_year(df):
+    if "TD_Date" in df.columns:
+        df["TD_Year"] = parse_td_date(df["TD_Date"]).dt.year.astype("Int32")
+    return df
+
+
+def build_store(csv_path=CSV_PATH, store_path=STORE_PATH, chunk_rows=BUILD_CHUNK_ROWS):
+    """Rewrite the partitioned Parquet store from the flat CSV, one chunk at a time.
+
+    The new store is built beside the old one and swapped in only once every chunk
+    has been written, so a failed build leaves the previous store in place.
+    """
+    if ds is None:
+        raise ImportError("pyarrow is required to build the partitioned dataset")
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    # Fixed up front: per-chunk inference types all-null chunks differently from later ones
+    schema = _store_schema(columns)
+    build_path = f"{store_path}.building"
+    if os.path.isdir(build_path):
+        shutil.rmtree(build_path)
+    try:
+        for i, chunk in enumerate(pd.read_csv(csv_path, chunksize=chunk_rows, dtype=_text_dtypes(columns))):
+            # Sorted by Operator so row groups cover few operators and the Operator predicate can skip them
+            chunk = add_td_year(chunk).sort_values("Operator", kind="stable")
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            ds.write_dataset(table, build_path, format="parquet", partitioning=_partitioning(),
+                             basename_template=f"part-{i}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore")
+    except Exception:
+        shutil.rmtree(build_path, ignore_errors=True)
+        raise
+    old_path = f"{store_path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.isdir(store_path):
+        os.replace(store_path, old_path)
+    os.replace(build_path, store_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def peer_groups(df):
+    """Peer-group keys per well: DI Basin, Hole_Size and shaker vendor."""
+    peers = pd.DataFrame(index=df.index)
+    # DI Basin only: the sparse Basin column names basins differently ("PERMIAN BASIN" vs "DELAWARE")
+    peers["Peer_Basin"] = df["DI Basin"].fillna("Unknown") if "DI Basin" in df.columns else "Unknown"
+    # Nearest 1/8": 7.87, 7.875 and 7.88 are the same bit size recorded differently
+    peers["Hole_Size"] = (df["Hole_Size"] * 8).round() / 8
+    peers["Shaker_Vendor"] = df["flowline_Shakers"].str.extract(r"^(MI Swaco|\S+)", expand=False).fillna("Unknown")
+    return peers
+
+
+def store_available(store_path=STORE_PATH):
+    return ds is not None and os.path.isdir(store_path)
+
+
+def dataset_version(store_path=STORE_PATH, csv_path=CSV_PATH):
+    """Identifies the data load_wells() would read; changes whenever the source is rebuilt or edited."""
+    path = store_path if store_available(store_path) else csv_path
+    return path, os.path.getmtime(path)
+
+
+def _predicate(operator=None, basins=None, years=None):
+    expr = None
+    if operator not in (None, "All"):
+        expr = ds.field("Operator") == operator
+    if basins:
+        clause = ds.field("DI Basin").isin(list(basins))
+        expr = clause if expr is None else expr & clause
+    if years:
+        clause = (ds.field("TD_Year") >= int(years[0])) & (ds.field("TD_Year") <= int(years[1]))
+        expr = clause if expr is None else expr & clause
+    return expr
+
+
+def load_wells(operator=None, basins=None, years=None, columns=None, store_path=STORE_PATH, csv_path=CSV_PATH):
+    """Load wells matching the selection as a DataFrame.
+
+    Basin and year filters prune whole partitions, the Operator filter is pushed
+    down to the Parquet row groups, and only ``columns`` are read. Without pyarrow
+    or a built store this falls back to reading the CSV and filtering in memory.
+    """
+    if store_available(store_path):
+        dataset = ds.dataset(store_path, format="parquet", partitioning=_partitioning())
+        if columns is not None:
+            columns = [c for c in columns if c in dataset.schema.names]
+        df = dataset.to_table(columns=columns, filter=_predicate(operator, basins, years)).to_pandas()
+    else:
+        df = _load_csv(csv_path, operator, basins, years, columns)
+    if "Efficiency Score" in df.columns and df["Efficiency Score"].isnull().all():
+        df.drop(columns=["Efficiency Score"], inplace=True)
+    return df
+
+
+def _load_csv(csv_path, operator, basins, years, columns):
+    df = add_td_year(pd.read_csv(csv_path, dtype=_text_dtypes(pd.read_csv(csv_path, nrows=0).columns)))
+    if operator not in (None, "All"):
+        df = df[df["Operator"] == operator]
+    if basins:
+        df = df[df["DI Basin"].isin(basins)]
+    if years:
+        df = df[df["TD_Year"].between(years[0], years[1])]
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df.reset_index(drop=True)
+
+
+def partition_values(store_path=STORE_PATH, csv_path=CSV_PATH):
+    """Distinct basins and TD years, read from partition keys only."""
+    df = load_wells(columns=["DI Basin", "TD_Year"], store_path=store_path, csv_path=csv_path)
+    return sorted(df["DI Basin"].dropna().unique().tolist()), sorted(int(y) for y in df["TD_Year"].dropna().unique())
+
+
+if __name__ == "__main__":
+    build_store()
+    print(f"Partitioned dataset written to {STORE_PATH}")
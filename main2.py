@@ -1,19 +1,128 @@
 # full_fixed_dashboard.py
+import os
+import tempfile
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.express as px
+from dataset import MIN_PEERS, PEER_COLUMNS, PEER_KEYS, ROW_ID, dataset_version, load_wells, partition_values, peer_groups, td_month
+from aggregate_service import fetch_aggregate
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
 
 st.set_page_config(page_title="Rig Comparison Dashboard", layout="wide")
 st.title("🚀 Rig Comparison Dashboard")
 
 @st.cache_data
-def load_data():
-    df = pd.read_csv("Updated_Merged_Data_with_API_and_Location.csv")
-    if "Efficiency Score" in df.columns and df["Efficiency Score"].isnull().all():
-        df.drop(columns=["Efficiency Score"], inplace=True)
-    return df
+def load_scope_options():
+    return partition_values()
+
+@st.cache_data
+def load_data(version, basins=None, years=None):
+    # Basin and TD year select partitions of the on-disk store, so cold loads scale with the scope.
+    # Keyed on the dataset version so a rebuilt store is reloaded, as the aggregate service does.
+    return load_wells(basins=basins, years=years)
+
+BENCHMARK_METRICS = ["DSRE", "Dilution_Ratio", "Discard Ratio", "Haul_OFF"]
+PEER_QUANTILES = {"P10": 0.1, "P50": 0.5, "P90": 0.9}
+
+def build_peer_benchmarks(df):
+    """Percentile ranks, P10/P50/P90 bands and peer quantile tables in one grouped pass."""
+    metrics = [m for m in BENCHMARK_METRICS if m in df.columns]
+    peers = peer_groups(df)
+    values = df[metrics]
+    grouped = values.groupby([peers[k] for k in PEER_KEYS])
+    peers["Peer_Count"] = grouped[metrics[0]].transform("size")
+
+    # Ranks use the same linear interpolation as the quantiles: lowest well is P0, highest P100
+    counts = grouped.transform("count")
+    sparse = counts < MIN_PEERS
+    ranks = grouped.rank().sub(1).div(counts.sub(1)).mul(100).mask(sparse)
+    p10, p50, p90 = (grouped.transform("quantile", q) for q in PEER_QUANTILES.values())
+    bands = pd.DataFrame(np.select(
+        [values <= p10, values <= p50, values <= p90, values > p90],
+        ["≤P10", "P10–P50", "P50–P90", "≥P90"],
+        default=None
+    ), index=df.index, columns=metrics).mask(sparse)
+
+    quantiles = grouped.quantile(list(PEER_QUANTILES.values()))
+    quantiles = quantiles.mask((grouped.count() < MIN_PEERS).reindex(quantiles.index.droplevel(-1)).to_numpy())
+    quantiles = quantiles.rename(index=dict(zip(PEER_QUANTILES.values(), PEER_QUANTILES.keys())), level=-1).sort_index()
+    # Row-aligned with the input so each well's badges are a single .loc lookup
+    benchmarks = pd.concat([peers, ranks.add_suffix("_Pctl"), bands.add_suffix("_Band")], axis=1)
+    return benchmarks, quantiles
+
+@st.cache_data
+def load_benchmarks(version):
+    # Peers span every basin, year and operator regardless of the Data Scope, so all wells are
+    # benchmarked, reading only the columns needed. Keyed on the dataset version, not the frame.
+    bench_df = load_wells(columns=[ROW_ID] + PEER_COLUMNS + BENCHMARK_METRICS).set_index(ROW_ID)
+    return build_peer_benchmarks(bench_df)
+
+EXPORT_CHUNK_ROWS = 50_000
+EXPORT_FORMATS = {"CSV": ("csv", "text/csv"),
+                  "Parquet": ("parquet", "application/octet-stream"),
+                  "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
 
-data = load_data()
+def sorted_row_order(df, sort_col, ascending):
+    # Only the sort key is sorted; rows are materialized later, one page or chunk at a time
+    if sort_col is None:
+        return df.index
+    return df[sort_col].sort_values(ascending=ascending, na_position="last", kind="stable").index
+
+def iter_chunks(df, columns, order, chunk_rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(order), chunk_rows):
+        yield df.loc[order[start:start + chunk_rows], columns]
+
+def write_export(df, columns, order, fmt, path):
+    if fmt == "CSV":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            for i, chunk in enumerate(iter_chunks(df, columns, order)):
+                chunk.to_csv(f, header=i == 0, index=False)
+    elif fmt == "Parquet":
+        # Schema comes from the whole projection, not the first chunk, where a mostly empty
+        # text column (e.g. Basin) would otherwise be typed as null
+        text_cols = {c: "string" for c in columns if df[c].dtype == object}
+        schema = pa.Schema.from_pandas(df[columns].head(0).astype(text_cols), preserve_index=False)
+        with pq.ParquetWriter(path, schema) as writer:
+            for chunk in iter_chunks(df, columns, order):
+                writer.write_table(pa.Table.from_pandas(chunk.astype(text_cols), schema=schema, preserve_index=False))
+    else:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Filtered Results")
+        ws.append(list(columns))
+        for chunk in iter_chunks(df, columns, order):
+            for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False):
+                ws.append(list(row))
+        wb.save(path)
+
+# --- Data scope ---
+scope_basins, scope_years = load_scope_options()
+with st.expander("🗂️ Data Scope", expanded=False):
+    sc1, sc2 = st.columns(2)
+    with sc1:
+        selected_basins = st.multiselect("Basins to load", scope_basins, help="Leave empty to load all basins.")
+    with sc2:
+        selected_years = st.slider("TD years to load", scope_years[0], scope_years[-1], (scope_years[0], scope_years[-1])) \
+            if len(scope_years) > 1 else None
+if scope_years and selected_years == (scope_years[0], scope_years[-1]):
+    # Full range also keeps wells without a TD date
+    selected_years = None
+
+data = load_data(dataset_version(), tuple(selected_basins) or None, selected_years)
+if data.empty:
+    st.warning("⚠️ No wells found for the selected data scope.")
+    st.stop()
+benchmarks, peer_tables = load_benchmarks(dataset_version())
 filtered = data.copy()
 
 # --- Sidebar filters and search ---
@@ -48,6 +157,8 @@ with st.container():
                 filtered = filtered[filtered["Hole_Size"] == selected_hole]
 
 # --- Advanced filters ---
+int_range = amw_range = lgs_range = None
+selected_year = selected_month = "All"
 with st.expander("⚙️ Advanced Filters", expanded=False):
     col1, col2 = st.columns(2)
     with col1:
@@ -66,9 +177,6 @@ with st.expander("⚙️ Advanced Filters", expanded=False):
             filtered = filtered[(filtered["Average_LGS%"] >= lgs_range[0]) & (filtered["Average_LGS%"] <= lgs_range[1])]
         if "TD_Date" in data.columns and not data["TD_Date"].isnull().all():
             try:
-                data["TD_Date"] = pd.to_datetime(data["TD_Date"], errors='coerce')
-                data["TD_Year"] = data["TD_Date"].dt.year
-                data["TD_Month"] = data["TD_Date"].dt.strftime('%B')
                 td_years = sorted(data["TD_Year"].dropna().unique())
                 td_months = ["January", "February", "March", "April", "May", "June",
                              "July", "August", "September", "October", "November", "December"]
@@ -77,19 +185,30 @@ with st.expander("⚙️ Advanced Filters", expanded=False):
                 if selected_year != "All":
                     filtered = filtered[filtered["TD_Year"] == selected_year]
                 if selected_month != "All":
-                    filtered = filtered[filtered["TD_Month"] == selected_month]
+                    filtered = filtered[td_month(filtered["TD_Date"]) == selected_month]
             except Exception as e:
                 st.warning(f"⚠️ TD_Date processing failed: {e}")
 
+# Aggregates come from the shared aggregate service (python aggregate_service.py), or are computed locally if it is down
+query = {
+    "search": search_term, "operator": selected_operator, "contractor": selected_contractor,
+    "shaker": selected_shaker if "flowline_Shakers" in data.columns else None,
+    "hole_size": selected_hole if "Hole_Size" in data.columns else None,
+    "basins": selected_basins, "years": selected_years,
+    "int_length": int_range, "amw": amw_range, "lgs": lgs_range,
+    "td_year": selected_year, "td_month": selected_month
+}
+kpi = fetch_aggregate("kpis", query, local_data=data)
+
 # --- Summary metrics ---
 st.markdown("### 📊 Key Metrics")
 m1, m2, m3 = st.columns(3)
 with m1:
-    st.metric("Avg Total Dilution", f"{filtered['Total_Dil'].mean():,.2f} BBLs")
+    st.metric("Avg Total Dilution", f"{kpi['avg_total_dil']:,.2f} BBLs")
 with m2:
-    st.metric("Avg SCE", f"{filtered['Total_SCE'].mean():,.2f}")
+    st.metric("Avg SCE", f"{kpi['avg_sce']:,.2f}")
 with m3:
-    st.metric("Avg DSRE", f"{filtered['DSRE'].mean()*100:.1f}%")
+    st.metric("Avg DSRE", f"{kpi['avg_dsre']*100:.1f}%")
 
 # --- Tabs and their logic ---
 tabs = st.tabs([
@@ -98,7 +217,8 @@ tabs = st.tabs([
     "📊 Statistical Insights",
     "📈 Advanced Analytics",
     "🧮 Multi-Well Comparison",
-    "⚙️ Advanced Filters"
+    "⚙️ Advanced Filters",
+    "🏅 Peer Benchmarks"
 ])
 
 with tabs[0]:
@@ -123,11 +243,11 @@ with tabs[1]:
 
 with tabs[2]:
     st.subheader("📊 Statistical Summary & Insights")
-    st.metric("📈 Mean DSRE", f"{filtered['DSRE'].mean()*100:.2f}%")
-    st.metric("🚛 Max Haul Off", f"{filtered['Haul_OFF'].max():,.0f}")
-    st.metric("🧪 Avg SCE", f"{filtered['Total_SCE'].mean():,.2f}")
-    st.metric("💧 Avg Dilution", f"{filtered['Total_Dil'].mean():,.2f}")
-    st.metric("⛏️ Max Depth", f"{filtered['Depth'].max():,.0f}" if "Depth" in filtered.columns else "N/A")
+    st.metric("📈 Mean DSRE", f"{kpi['avg_dsre']*100:.2f}%")
+    st.metric("🚛 Max Haul Off", f"{kpi['max_haul_off']:,.0f}")
+    st.metric("🧪 Avg SCE", f"{kpi['avg_sce']:,.2f}")
+    st.metric("💧 Avg Dilution", f"{kpi['avg_total_dil']:,.2f}")
+    st.metric("⛏️ Max Depth", f"{kpi['max_depth']:,.0f}" if pd.notnull(kpi["max_depth"]) else "N/A")
 
 with tabs[3]:
     st.subheader("📈 Advanced Analytics")
@@ -135,7 +255,8 @@ with tabs[3]:
         st.plotly_chart(px.scatter(filtered, x="ROP", y="Temp", color="Well_Name"), use_container_width=True)
     if "Base_Oil" in filtered.columns and "Water" in filtered.columns:
         st.plotly_chart(px.scatter(filtered, x="Base_Oil", y="Water", size="Total_Dil", color="Well_Name"), use_container_width=True)
-    st.plotly_chart(px.imshow(filtered[[c for c in ["DSRE", "Total_SCE", "Total_Dil", "Discard Ratio", "Dilution_Ratio", "ROP", "AMW", "Haul_OFF"] if c in filtered.columns]].corr(), text_auto=True, aspect="auto"), use_container_width=True)
+    corr_matrix = fetch_aggregate("correlations", {**query, "pairwise": 1}, local_data=data)
+    st.plotly_chart(px.imshow(corr_matrix, text_auto=True, aspect="auto"), use_container_width=True)
 
 with tabs[4]:
     st.subheader("🧮 Multi-Well Comparison")
@@ -143,17 +264,74 @@ with tabs[4]:
         filtered["Shaker_Type"] = filtered["flowline_Shakers"].apply(lambda x: "Derrick" if isinstance(x, str) and "derrick" in x.lower() else "Non-Derrick")
         selected_metrics = st.multiselect("Select Metrics", ["DSRE", "Discard Ratio", "Total_SCE", "Total_Dil", "ROP"], default=["DSRE", "ROP"])
         if selected_metrics:
-            derrick = filtered[filtered["Shaker_Type"] == "Derrick"][selected_metrics].mean().reset_index()
-            non_derrick = filtered[filtered["Shaker_Type"] == "Non-Derrick"][selected_metrics].mean().reset_index()
-            derrick.columns = ["Metric", "Derrick"]
-            non_derrick.columns = ["Metric", "Non-Derrick"]
-            merged = pd.merge(derrick, non_derrick, on="Metric")
-            melted = pd.melt(merged, id_vars="Metric", value_vars=["Derrick", "Non-Derrick"], var_name="Shaker_Type", value_name="Average")
+            melted = fetch_aggregate("shaker_comparison", {**query, "metrics": selected_metrics}, local_data=data)
             st.plotly_chart(px.bar(melted, x="Metric", y="Average", color="Shaker_Type", barmode="group"), use_container_width=True)
 
 with tabs[5]:
     st.subheader("⚙️ Filtered Results Preview")
-    st.dataframe(filtered, use_container_width=True)
+    all_cols = filtered.columns.tolist()
+    c1, c2, c3, c4 = st.columns([3, 1.5, 1, 1])
+    with c1:
+        shown_cols = st.multiselect("Columns", all_cols, default=all_cols) or all_cols
+    with c2:
+        sort_col = st.selectbox("Sort by", [None] + all_cols, format_func=lambda c: "(none)" if c is None else c)
+    with c3:
+        ascending = st.radio("Order", ["Ascending", "Descending"], horizontal=True) == "Ascending"
+    with c4:
+        page_size = st.selectbox("Rows per page", [25, 50, 100, 250, 500], index=2)
+
+    order = sorted_row_order(filtered, sort_col, ascending)
+    n_pages = max(1, -(-len(order) // page_size))
+    page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1)
+    start = (page - 1) * page_size
+    st.caption(f"Showing rows {min(start + 1, len(order))}–{min(start + page_size, len(order))} of {len(order)} (page {page} of {n_pages})")
+    st.dataframe(filtered.loc[order[start:start + page_size], shown_cols], use_container_width=True)
+
+    st.markdown("**📥 Export filtered selection**")
+    available_formats = [f for f in EXPORT_FORMATS
+                         if not (f == "Parquet" and pq is None) and not (f == "Excel" and Workbook is None)]
+    e1, e2 = st.columns([1, 3])
+    with e1:
+        export_fmt = st.selectbox("Format", available_formats)
+    with e2:
+        if st.button("Prepare export"):
+            ext, mime = EXPORT_FORMATS[export_fmt]
+            fd, export_path = tempfile.mkstemp(prefix="rig_export_", suffix=f".{ext}")
+            os.close(fd)
+            try:
+                write_export(filtered, shown_cols, order, export_fmt, export_path)
+                with open(export_path, "rb") as f:
+                    st.download_button(f"Download {export_fmt}", data=f, file_name=f"filtered_results.{ext}", mime=mime)
+            except Exception as e:
+                st.error(f"Export failed: {e}")
+            finally:
+                os.remove(export_path)
+
+with tabs[6]:
+    st.subheader("🏅 Peer Benchmarks")
+    st.markdown("Percentile rank of a well against wells in the same Basin, Hole Size and shaker vendor.")
+    if filtered.empty:
+        st.info("No wells match the current filters.")
+    else:
+        well_idx = st.selectbox("Select well", filtered.index, format_func=lambda i: f"{filtered.at[i, 'Well_Name']} (#{i})")
+        well = benchmarks.loc[filtered.at[well_idx, ROW_ID]]
+        if pd.isna(well["Hole_Size"]):
+            st.warning("⚠️ This well has no Hole Size recorded, so it has no peer group.")
+        elif well["Peer_Count"] < MIN_PEERS:
+            st.info(f"ℹ️ Insufficient peers: {int(well['Peer_Count'])} well(s) in {well['Peer_Basin']} | "
+                    f"{well['Hole_Size']}\" | {well['Shaker_Vendor']}, at least {MIN_PEERS} are needed for benchmarks.")
+        else:
+            peer_table = peer_tables.loc[tuple(well[PEER_KEYS])]
+            st.caption(f"Peer group: {well['Peer_Basin']} | {well['Hole_Size']}\" | {well['Shaker_Vendor']} — {int(well['Peer_Count'])} wells")
+            metrics = [m for m in BENCHMARK_METRICS if m in peer_table.columns]
+            for col, metric in zip(st.columns(len(metrics)), metrics):
+                with col:
+                    value, pctl, band = data.at[well_idx, metric], well[f"{metric}_Pctl"], well[f"{metric}_Band"]
+                    st.metric(metric, f"{value:,.2f}" if pd.notnull(value) else "N/A",
+                              f"P{pctl:.0f} · {band}" if pd.notnull(pctl) and pd.notnull(band) else "insufficient peers",
+                              delta_color="off")
+            st.markdown("**Peer quantile table**")
+            st.dataframe(peer_table[metrics], use_container_width=True)
 
 # --- Footer ---
 st.markdown("""
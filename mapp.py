@@ -1,9 +1,11 @@
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.express as px
 import pydeck as pdk
-import os
+from dataset import MIN_PEERS, PEER_COLUMNS, PEER_KEYS, ROW_ID, dataset_version, load_wells, peer_groups
+from aggregate_service import fetch_aggregate
 
 st.set_page_config(layout="wide", page_title="Rig Comparison Dashboard", page_icon="📊")
 
@@ -91,10 +93,48 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ---------- Load Data ----------
-default_path = os.path.join(os.path.dirname(__file__), "Updated_Merged_Data_with_API_and_Location.csv")
-data = pd.read_csv(default_path)
-if "Efficiency Score" in data.columns and data["Efficiency Score"].isnull().all():
-    data.drop(columns=["Efficiency Score"], inplace=True)
+# Reads the partitioned Parquet store when it has been built (python dataset.py), else the flat CSV.
+# Every loader is keyed on the dataset version so a rebuilt store is reloaded, as the aggregate service does.
+@st.cache_data
+def load_operators(version):
+    return sorted(load_wells(columns=["Operator"])["Operator"].dropna().unique().tolist())
+
+@st.cache_data
+def load_data(version, operator):
+    # The Operator selection is pushed down to the store, which skips row groups (sorted by Operator) without it
+    return load_wells(operator=operator)
+
+dataset_ver = dataset_version()
+
+# ---------- Anomaly Scoring ----------
+ANOMALY_METRICS = ["DSRE", "Total_Dil", "Discard Ratio", "Dil_Per_Hole_Vol_Ratio", "Average_LGS%", "ROP"]
+ANOMALY_Z = 3.5
+
+def score_anomalies(df):
+    metrics = [m for m in ANOMALY_METRICS if m in df.columns]
+    peers = peer_groups(df)
+    keys = [peers[k] for k in PEER_KEYS]
+    # One batched pass: robust z = 0.6745 * (x - median) / MAD within each peer group, all metrics at once
+    values = df[metrics]
+    grouped = values.groupby(keys)
+    deviation = values - grouped.transform("median")
+    mad = deviation.abs().groupby(keys).transform("median").replace(0, np.nan)
+    z = (0.6745 * deviation / mad).mask(grouped.transform("count") < MIN_PEERS)
+
+    outliers = z.abs() > ANOMALY_Z
+    scores = pd.DataFrame(index=df.index)
+    scores["Anomaly_Score"] = z.abs().max(axis=1)
+    scores["Is_Anomaly"] = outliers.any(axis=1)
+    scores["Anomaly_Metrics"] = outliers.dot(pd.Index(metrics) + ", ").str.rstrip(", ")
+    return pd.concat([scores, z.add_suffix("_z")], axis=1)
+
+@st.cache_data
+def load_anomaly_scores(version):
+    # Peer groups span every operator, so all wells are scored, reading only the columns scoring needs
+    scoring_df = load_wells(columns=[ROW_ID] + PEER_COLUMNS + ANOMALY_METRICS).set_index(ROW_ID)
+    return score_anomalies(scoring_df)
+
+anomalies = load_anomaly_scores(dataset_ver)
 
 # ---------- Jet Black Footer ----------
 st.markdown("""
@@ -112,9 +152,10 @@ st.markdown("Use filters to explore well-level, shaker-type, and fluid performan
 with st.container():
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        selected_operator = st.selectbox("Select Operator", ["All"] + sorted(data["Operator"].dropna().unique().tolist()))
+        selected_operator = st.selectbox("Select Operator", ["All"] + load_operators(dataset_ver))
+        data = load_data(dataset_ver, selected_operator)
     with col2:
-        filtered_by_op = data if selected_operator == "All" else data[data["Operator"] == selected_operator]
+        filtered_by_op = data  # load_data already read only the selected operator's rows
         selected_contractor = st.selectbox("Select Contractor", ["All"] + sorted(filtered_by_op["Contractor"].dropna().unique().tolist()))
     with col3:
         filtered_by_contractor = filtered_by_op if selected_contractor == "All" else filtered_by_op[filtered_by_op["Contractor"] == selected_contractor]
@@ -125,15 +166,19 @@ with st.container():
 
     filtered = filtered_by_shaker if selected_hole == "All" else filtered_by_shaker[filtered_by_shaker["Hole_Size"] == selected_hole]
 
+# Aggregates come from the shared aggregate service (python aggregate_service.py), or are computed locally if it is down
+query = {"operator": selected_operator, "contractor": selected_contractor, "shaker": selected_shaker, "hole_size": selected_hole}
+kpi = fetch_aggregate("kpis", query, local_data=data)
+
 # ---------- METRICS ----------
 st.markdown("### 📈 Key Performance Metrics")
 m1, m2, m3 = st.columns(3)
 with m1:
-    st.metric("Avg Total Dilution", f"{filtered['Total_Dil'].mean():,.2f} BBLs")
+    st.metric("Avg Total Dilution", f"{kpi['avg_total_dil']:,.2f} BBLs")
 with m2:
-    st.metric("Avg SCE", f"{filtered['Total_SCE'].mean():,.2f}")
+    st.metric("Avg SCE", f"{kpi['avg_sce']:,.2f}")
 with m3:
-    st.metric("Avg DSRE", f"{filtered['DSRE'].mean()*100:.1f}%")
+    st.metric("Avg DSRE", f"{kpi['avg_dsre']*100:.1f}%")
 
 # ---------- MAIN TABS ----------
 tabs = st.tabs(["🧾 Well Overview", "📋 Summary & Charts", "📊 Statistical Insights", "📈 Advanced Analytics", "🧮 Multi-Well Comparison"])
@@ -259,26 +304,26 @@ with tabs[2]:
 
     k1, k2, k3, k4 = st.columns(4)
     with k1:
-        st.metric("📈 Mean DSRE", f"{filtered['DSRE'].mean()*100:.2f}%")
+        st.metric("📈 Mean DSRE", f"{kpi['avg_dsre']*100:.2f}%")
     with k2:
-        st.metric("🚛 Max Haul Off", f"{filtered['Haul_OFF'].max():,.0f}")
+        st.metric("🚛 Max Haul Off", f"{kpi['max_haul_off']:,.0f}")
     with k3:
-        st.metric("🧪 Avg SCE", f"{filtered['Total_SCE'].mean():,.2f}")
+        st.metric("🧪 Avg SCE", f"{kpi['avg_sce']:,.2f}")
     with k4:
-        st.metric("💧 Avg Dilution", f"{filtered['Total_Dil'].mean():,.2f}")
+        st.metric("💧 Avg Dilution", f"{kpi['avg_total_dil']:,.2f}")
 
     k5, k6, k7, k8 = st.columns(4)
     with k5:
-        max_depth = filtered['Depth'].max() if "Depth" in filtered.columns else None
+        max_depth = kpi["max_depth"]
         st.metric("⛏️ Max Depth", f"{max_depth:,.0f}" if pd.notnull(max_depth) else "N/A")
 
     with k6:
-        avg_lgs = filtered["Average_LGS%"].mean() if "Average_LGS%" in filtered.columns else None
+        avg_lgs = kpi["avg_lgs"]
         st.metric("🌀 Avg LGS%", f"{avg_lgs:.2f}" if pd.notnull(avg_lgs) else "N/A")
 
     with k7:
         if "Dilution_Ratio" in filtered.columns:
-            avg_dil = filtered["Dilution_Ratio"].mean()
+            avg_dil = kpi["avg_dilution_ratio"]
             dil_icon = "🟢" if avg_dil < 1 else "🟡" if avg_dil < 2 else "🔴"
             st.metric("🥄 Dilution Ratio", f"{avg_dil:.2f} {dil_icon}")
         else:
@@ -286,7 +331,7 @@ with tabs[2]:
 
     with k8:
         if "Discard Ratio" in filtered.columns:
-            avg_disc = filtered["Discard Ratio"].mean()
+            avg_disc = kpi["avg_discard_ratio"]
             disc_icon = "🟢" if avg_disc < 0.1 else "🟡" if avg_disc < 0.2 else "🔴"
             st.metric("🗑️ Discard Ratio", f"{avg_disc:.2f} {disc_icon}")
         else:
@@ -303,6 +348,41 @@ with tabs[2]:
     else:
         st.info("DSRE column not found for efficiency insights.")
 
+    st.markdown("#### 🚨 Peer-Group Anomalies")
+    st.caption(f"Wells whose robust z-score exceeds {ANOMALY_Z} against wells with the same Basin, Hole Size and shaker vendor "
+               f"(groups with fewer than {MIN_PEERS} wells are not scored).")
+    filtered_anomalies = anomalies.reindex(filtered[ROW_ID]).set_axis(filtered.index)
+    flagged = filtered_anomalies[filtered_anomalies["Is_Anomaly"]]
+    if flagged.empty:
+        st.success("✅ No anomalous wells in the current selection.")
+    else:
+        st.error(f"🚨 **Anomalous Wells**: {len(flagged)}")
+        flagged_view = filtered.loc[flagged.index, ["Well_Name", "Operator", "flowline_Shakers", "Hole_Size"]]\
+            .join(flagged[["Anomaly_Score", "Anomaly_Metrics"]])\
+            .sort_values(by="Anomaly_Score", ascending=False)
+        st.dataframe(flagged_view, use_container_width=True)
+
+    st.markdown("#### 🗺️ Anomaly Map")
+    lat = filtered["Latitude"].fillna(filtered["Well_Coord_Lat"]) if "Latitude" in filtered.columns else None
+    lon = filtered["Longitude"].fillna(filtered["Well_Coord_Lon"]) if "Longitude" in filtered.columns else None
+    if lat is not None and lon is not None and lat.notna().any():
+        map_df = pd.DataFrame({
+            "Well_Name": filtered["Well_Name"],
+            "lat": lat,
+            "lon": lon,
+            "Anomaly_Metrics": filtered_anomalies["Anomaly_Metrics"].replace("", "None"),
+            "color": filtered_anomalies["Is_Anomaly"].map({True: [214, 39, 40, 200], False: [0, 117, 53, 140]}),
+        }).dropna(subset=["lat", "lon"])
+        st.pydeck_chart(pdk.Deck(
+            map_style=None,
+            initial_view_state=pdk.ViewState(latitude=map_df["lat"].mean(), longitude=map_df["lon"].mean(), zoom=4),
+            layers=[pdk.Layer("ScatterplotLayer", data=map_df, get_position="[lon, lat]", get_fill_color="color",
+                              get_radius=6000, pickable=True)],
+            tooltip={"text": "{Well_Name}\nAnomalous: {Anomaly_Metrics}"}
+        ))
+    else:
+        st.info("Latitude/Longitude columns not found for anomaly map.")
+
 # ---------- TAB 4: ADVANCED ANALYTICS ----------
 with tabs[3]:
     with st.expander("ℹ️ What does this section show?", expanded=False):
@@ -350,8 +430,8 @@ This section helps the **drilling engineer** understand how mud composition, tem
     st.markdown("#### 📌 Correlation Heatmap")
     try:
         corr_cols = ["DSRE", "Total_SCE", "Total_Dil", "Discard Ratio", "Dilution_Ratio", "ROP", "AMW", "Haul_OFF"]
-        corr_data = filtered[corr_cols].dropna()
-        fig_corr = px.imshow(corr_data.corr(), text_auto=True, aspect="auto", color_continuous_scale='Blues')
+        corr_matrix = fetch_aggregate("correlations", {**query, "metrics": corr_cols}, local_data=data)
+        fig_corr = px.imshow(corr_matrix, text_auto=True, aspect="auto", color_continuous_scale='Blues')
         st.plotly_chart(fig_corr, use_container_width=True)
     except Exception as e:
         st.error(f"Correlation heatmap error: {e}")
@@ -390,18 +470,7 @@ This section compares **shaker performance** across rig setups:
         selected_metrics = st.multiselect("📌 Select Metrics to Compare", compare_cols, default=["DSRE", "ROP", "Total_Dil"])
 
         if selected_metrics:
-            derrick_group = filtered[filtered["Shaker_Type"] == "Derrick"]
-            non_derrick_group = filtered[filtered["Shaker_Type"] == "Non-Derrick"]
-
-            derrick_avg = derrick_group[selected_metrics].mean().reset_index()
-            derrick_avg.columns = ["Metric", "Derrick"]
-
-            non_derrick_avg = non_derrick_group[selected_metrics].mean().reset_index()
-            non_derrick_avg.columns = ["Metric", "Non-Derrick"]
-
-            merged_avg = pd.merge(derrick_avg, non_derrick_avg, on="Metric")
-            melted_avg = pd.melt(merged_avg, id_vars="Metric", value_vars=["Derrick", "Non-Derrick"], 
-                                 var_name="Shaker_Type", value_name="Average")
+            melted_avg = fetch_aggregate("shaker_comparison", {**query, "metrics": selected_metrics}, local_data=data)
 
             fig = px.bar(
                 melted_avg, x="Metric", y="Average", color="Shaker_Type",
@@ -452,27 +521,16 @@ if st.button("📊 Run Enhanced Cost Comparison"):
             op_days = st.number_input("📆 Operating Days", value=10, min_value=1, step=1, key="op_days")
 
     if "flowline_Shakers" in filtered.columns:
-        filtered["Shaker_Type"] = filtered["flowline_Shakers"].apply(
-            lambda x: "Derrick" if isinstance(x, str) and "derrick" in x.lower() else "Non-Derrick"
-        )
-        derrick_df = filtered[filtered["Shaker_Type"] == "Derrick"]
-        non_derrick_df = filtered[filtered["Shaker_Type"] == "Non-Derrick"]
-
-        def calc_cost(df, screen_cost, equip_rate):
-            num_screens = len(df)
-            wells = df["Well_Name"].nunique()
-            scr = num_screens * (op_days / screen_life) * screen_cost
-            eq = wells * op_days * equip_rate
-            eng = wells * op_days * eng_rate
-            total = scr + eq + eng
-            depth = df["Depth"].sum() if "Depth" in df.columns else 1
-            cpf = total / depth if depth else 0
-            return total, cpf, scr, eq, eng, depth
-
-        d_total, d_cpf, d_scr, d_eq, d_eng, d_depth = calc_cost(derrick_df, d_screen_cost, d_equip_rate)
-        n_total, n_cpf, n_scr, n_eq, n_eng, n_depth = calc_cost(non_derrick_df, nd_screen_cost, nd_equip_rate)
-
-        saving = n_total - d_total
+        cost = fetch_aggregate("costs", {
+            **query,
+            "d_screen_cost": d_screen_cost, "nd_screen_cost": nd_screen_cost,
+            "d_equip_rate": d_equip_rate, "nd_equip_rate": nd_equip_rate,
+            "screen_life": screen_life, "eng_rate": eng_rate, "op_days": op_days
+        }, local_data=data)
+        d, n = cost["Derrick"], cost["Non-Derrick"]
+        d_total, d_cpf, d_scr, d_eq, d_eng = d["total"], d["cpf"], d["screen"], d["equipment"], d["engineering"]
+        n_total, n_cpf, n_scr, n_eq, n_eng = n["total"], n["cpf"], n["screen"], n["equipment"], n["engineering"]
+        saving = cost["saving"]
 
         c1, c2 = st.columns(2)
         with c1: